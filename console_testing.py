@@ -28,7 +28,7 @@ def main():
             conn.close()
 
             print("[DEBUG] Generating recommendations...")
-            recommendations = recommend(steam_id, top_n=2)
+            recommendations = recommend(steam_id, top_n=2, use_cache=True)
 
             print(f"\nRecommended Games for Steam ID {steam_id}:")
             print("-" * 50)
@@ -1,9 +1,11 @@
 import sqlite3
 import os
+import json
 import time
 from datetime import datetime, timedelta
 from fetch_data import fetch_owned_games, fetch_friends, fetch_store_info
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from vocabulary import TAGS, DEVELOPERS, split_developer_names
 
 analyzer = SentimentIntensityAnalyzer()
 
@@ -35,6 +37,14 @@ def normalize_data():
             DELETE FROM Games WHERE game_id NOT IN (SELECT DISTINCT game_id FROM UserGames)
         """)
 
+        cursor.execute("""
+            DELETE FROM GameTagIds WHERE game_id NOT IN (SELECT game_id FROM Games)
+        """)
+
+        cursor.execute("""
+            DELETE FROM GameDevelopers WHERE game_id NOT IN (SELECT game_id FROM Games)
+        """)
+
         conn.commit()
         print("[DEBUG] Data normalization completed successfully")
     except Exception as e:
@@ -107,6 +117,18 @@ def setup_database_schema():
     )
     ''')
 
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS TrackedUsers (
+        user_id INTEGER PRIMARY KEY,
+        FOREIGN KEY (user_id) REFERENCES Users(user_id)
+    )
+    ''')
+
+    # Before TrackedUsers existed, only tracked users had their friend lists stored
+    cursor.execute('''
+    INSERT OR IGNORE INTO TrackedUsers (user_id) SELECT DISTINCT user_id FROM Friends
+    ''')
+
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS Reviews (
         review_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -128,6 +150,88 @@ def setup_database_schema():
     )
     ''')
 
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Tags (
+        tag_id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Developers (
+        developer_id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS GameTagIds (
+        game_id INTEGER,
+        tag_id INTEGER,
+        PRIMARY KEY (game_id, tag_id),
+        FOREIGN KEY (game_id) REFERENCES Games(game_id),
+        FOREIGN KEY (tag_id) REFERENCES Tags(tag_id)
+    ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS GameDevelopers (
+        game_id INTEGER,
+        developer_id INTEGER,
+        PRIMARY KEY (game_id, developer_id),
+        FOREIGN KEY (game_id) REFERENCES Games(game_id),
+        FOREIGN KEY (developer_id) REFERENCES Developers(developer_id)
+    ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS PlaytimeEvents (
+        user_id INTEGER,
+        game_id INTEGER,
+        delta_hours REAL,
+        recorded_at TEXT
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_playtime_events_time ON PlaytimeEvents (recorded_at, user_id)
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS PlaytimeRollups (
+        user_id INTEGER,
+        game_id INTEGER,
+        period TEXT,
+        delta_hours REAL,
+        PRIMARY KEY (user_id, game_id, period)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS UserProfiles (
+        user_id INTEGER PRIMARY KEY,
+        profile TEXT,
+        last_updated TEXT,
+        FOREIGN KEY (user_id) REFERENCES Users(user_id)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS UserRecommendations (
+        user_id INTEGER,
+        rank INTEGER,
+        game_id INTEGER,
+        title TEXT,
+        tags TEXT,
+        developer TEXT,
+        price REAL,
+        final_score REAL,
+        last_updated TEXT,
+        PRIMARY KEY (user_id, rank),
+        FOREIGN KEY (user_id) REFERENCES Users(user_id)
+    )
+    ''')
+
     conn.commit()
     conn.close()
 
@@ -138,7 +242,62 @@ def setup_database():
         setup_database_schema()
         print("[DEBUG] Database setup complete!")
     else:
-        print("[DEBUG] Database already exists. Skipping setup.")
+        # Every table is CREATE IF NOT EXISTS, so this only adds tables missing from older databases
+        setup_database_schema()
+        encode_game_metadata()
+        print("[DEBUG] Database already exists. Schema is up to date.")
+
+
+def store_game_codes(cursor, game_id, tags, developer):
+    """Replace a game's integer-coded tags and developers with ones interned from text."""
+    cursor.execute("DELETE FROM GameTagIds WHERE game_id = ?", (game_id,))
+    cursor.executemany("INSERT OR IGNORE INTO GameTagIds (game_id, tag_id) VALUES (?, ?)",
+                       [(game_id, tag_id) for tag_id in TAGS.intern(cursor, tags)])
+
+    cursor.execute("DELETE FROM GameDevelopers WHERE game_id = ?", (game_id,))
+    cursor.executemany("INSERT OR IGNORE INTO GameDevelopers (game_id, developer_id) VALUES (?, ?)",
+                       [(game_id, dev_id) for dev_id in DEVELOPERS.intern(cursor, developer)])
+
+
+def encode_game_metadata():
+    """Backfill integer-coded tags and developers for games that only have the text columns."""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    try:
+        # Older encodings kept legal suffixes ("capcom co.") or interned them alone ("inc.");
+        # drop those names and re-encode the games that used them from the text column
+        cursor.execute("SELECT developer_id, name FROM Developers")
+        outdated = json.dumps([developer_id for developer_id, name in cursor.fetchall()
+                               if split_developer_names(name) != [name]])
+        cursor.execute("""
+            DELETE FROM GameDevelopers WHERE game_id IN (
+                SELECT game_id FROM GameDevelopers WHERE developer_id IN (SELECT value FROM json_each(?))
+            )
+        """, (outdated,))
+        cursor.execute("DELETE FROM Developers WHERE developer_id IN (SELECT value FROM json_each(?))", (outdated,))
+        if cursor.rowcount:
+            cursor.execute("DELETE FROM UserProfiles")
+            cursor.execute("DELETE FROM UserRecommendations")
+            DEVELOPERS.reset()
+
+        cursor.execute("""
+            SELECT game_id, tags, developer FROM Games
+            WHERE (tags IS NOT NULL AND game_id NOT IN (SELECT game_id FROM GameTagIds))
+            OR (developer IS NOT NULL AND developer != '' AND game_id NOT IN (SELECT game_id FROM GameDevelopers))
+        """)
+        games = cursor.fetchall()
+        for game_id, tags, developer in games:
+            store_game_codes(cursor, game_id, tags, developer)
+        conn.commit()
+        if games:
+            print(f"[DEBUG] Encoded tags and developers for {len(games)} games")
+    except Exception as e:
+        print(f"[ERROR] Error encoding game metadata: {e}")
+        conn.rollback()
+        TAGS.reset()
+        DEVELOPERS.reset()
+    finally:
+        conn.close()
 
 
 def should_update_user(steam_id, hours_threshold=24):
@@ -173,13 +332,46 @@ def get_games_needing_store_data():
     return games_to_update
 
 
-def get_current_playtime(steam_id, game_id):
+def rollup_playtime_events(retention_days=30):
+    """Fold playtime events older than retention_days into monthly rollups and delete them."""
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
-    cursor.execute("SELECT hours_played FROM UserGames WHERE user_id = ? AND game_id = ?", (steam_id, game_id))
-    result = cursor.fetchone()
+    try:
+        cursor.execute("""
+            INSERT INTO PlaytimeRollups (user_id, game_id, period, delta_hours)
+            SELECT user_id, game_id, substr(recorded_at, 1, 7), SUM(delta_hours)
+            FROM PlaytimeEvents
+            WHERE recorded_at < ?
+            GROUP BY user_id, game_id, substr(recorded_at, 1, 7)
+            ON CONFLICT(user_id, game_id, period) DO UPDATE SET
+                delta_hours = delta_hours + excluded.delta_hours
+        """, (cutoff,))
+        cursor.execute("DELETE FROM PlaytimeEvents WHERE recorded_at < ?", (cutoff,))
+        rolled_up = cursor.rowcount
+        conn.commit()
+        print(f"[DEBUG] Rolled up {rolled_up} playtime events older than {retention_days} days")
+    except Exception as e:
+        print(f"[ERROR] Error rolling up playtime events: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+def get_active_users(since_hours=24, min_delta_hours=1.0):
+    """Return ids of users whose recorded playtime moved by at least min_delta_hours recently."""
+    since = (datetime.now() - timedelta(hours=since_hours)).isoformat()
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT user_id FROM PlaytimeEvents
+        WHERE recorded_at >= ?
+        GROUP BY user_id
+        HAVING SUM(ABS(delta_hours)) >= ?
+    """, (since, min_delta_hours))
+    active_users = [row[0] for row in cursor.fetchall()]
     conn.close()
-    return result[0] if result else 0
+    return active_users
 
 
 def update_reviews_and_stats():
@@ -216,60 +408,68 @@ def update_reviews_and_stats():
     conn.close()
 
 
-def update_user_data(steam_id, api_key, force_update=False):
-    if not force_update and not should_update_user(steam_id):
-        print(f"[DEBUG] User {steam_id} was recently updated. Skipping...")
-        return
+def store_user_data(cursor, steam_id, games_data, store_infos, friends=None, now=None, tracked=False):
+    """Write already-fetched games, store data and friends for one user.
 
-    print(f"[DEBUG] Fetching data for Steam ID: {steam_id}")
-    conn = sqlite3.connect(DB_FILE)
-    conn.execute("PRAGMA foreign_keys = ON")
-    cursor = conn.cursor()
-
-    now = datetime.now().isoformat()
+    tracked marks the user for the refresh scheduler's regular passes.
+    Returns the number of games whose playtime changed.
+    """
+    now = now or datetime.now().isoformat()
     cursor.execute("""
         INSERT INTO Users (user_id, last_updated)
         VALUES (?, ?)
         ON CONFLICT(user_id) DO UPDATE SET last_updated=excluded.last_updated
     """, (steam_id, now))
+    if tracked:
+        cursor.execute("INSERT OR IGNORE INTO TrackedUsers (user_id) VALUES (?)", (steam_id,))
 
-    games_data = fetch_owned_games(steam_id)
-    games_needing_store_data = get_games_needing_store_data()
+    cursor.execute("SELECT game_id, hours_played FROM UserGames WHERE user_id = ?", (steam_id,))
+    stored_playtime = dict(cursor.fetchall())
 
     updated_games = 0
-    api_calls_made = 0
+    playtime_events = []
+    new_games = False
+    games_with_store_data = []
 
     for game in games_data:
         game_id = game['appid']
         title = game.get('name', 'Unknown')
         current_hours = game.get('playtime_forever', 0) / 60
-        stored_hours = get_current_playtime(steam_id, game_id)
+        stored_hours = stored_playtime.get(game_id) or 0
+        if game_id not in stored_playtime:
+            new_games = True
 
         if abs(current_hours - stored_hours) > 0.1:
             print(f"[DEBUG] Playtime changed for {title}: {stored_hours:.1f}h -> {current_hours:.1f}h")
             updated_games += 1
-
-        if game_id in games_needing_store_data:
-            store_data = fetch_store_info(game_id)
-            api_calls_made += 1
-            if store_data:
-                cursor.execute("""
-                    INSERT INTO Games (game_id, title, tags, developer, release_date, base_price, last_updated)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ON CONFLICT(game_id) DO UPDATE SET
-                        title=excluded.title,
-                        tags=excluded.tags,
-                        developer=excluded.developer,
-                        release_date=excluded.release_date,
-                        base_price=excluded.base_price,
-                        last_updated=excluded.last_updated
-                """, (game_id, title, store_data.get('tags'), store_data.get('developer'),
-                      store_data.get('release_date'), store_data.get('base_price'), now))
-
-                dlc_entries = [(dlc_id, game_id, None, None) for dlc_id in store_data.get('dlcs', [])]
-                cursor.executemany("""
-                    INSERT OR IGNORE INTO DLCs (dlc_id, game_id, title, price) VALUES (?, ?, ?, ?)
-                """, dlc_entries)
+            # A user's first import is their baseline, not activity
+            if stored_playtime:
+                playtime_events.append((steam_id, game_id, current_hours - stored_hours, now))
+
+        store_data = store_infos.get(game_id)
+        if store_data:
+            tags = store_data.get('tags')
+            if isinstance(tags, list):
+                tags = ", ".join(tags)
+            cursor.execute("""
+                INSERT INTO Games (game_id, title, tags, developer, release_date, base_price, last_updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(game_id) DO UPDATE SET
+                    title=excluded.title,
+                    tags=excluded.tags,
+                    developer=excluded.developer,
+                    release_date=excluded.release_date,
+                    base_price=excluded.base_price,
+                    last_updated=excluded.last_updated
+            """, (game_id, title, tags, store_data.get('developer'),
+                  store_data.get('release_date'), store_data.get('base_price'), now))
+            store_game_codes(cursor, game_id, tags, store_data.get('developers', store_data.get('developer')))
+            games_with_store_data.append(game_id)
+
+            dlc_entries = [(dlc_id, game_id, None, None) for dlc_id in store_data.get('dlcs', [])]
+            cursor.executemany("""
+                INSERT OR IGNORE INTO DLCs (dlc_id, game_id, title, price) VALUES (?, ?, ?, ?)
+            """, dlc_entries)
         else:
             cursor.execute("""
                 INSERT OR IGNORE INTO Games (game_id, title) VALUES (?, ?)
@@ -283,20 +483,79 @@ def update_user_data(steam_id, api_key, force_update=False):
                 last_updated=excluded.last_updated
         """, (steam_id, game_id, current_hours, None, 0, now))
 
-    print(f"[DEBUG] Made {api_calls_made} API calls, updated {updated_games} games with playtime changes")
+    cursor.executemany("""
+        INSERT INTO PlaytimeEvents (user_id, game_id, delta_hours, recorded_at) VALUES (?, ?, ?, ?)
+    """, playtime_events)
+
+    friends_changed = False
+    if friends is not None:
+        cursor.executemany("INSERT OR IGNORE INTO Users (user_id) VALUES (?)", [(f,) for f in friends])
+        cursor.executemany("INSERT OR IGNORE INTO Friends (user_id, friend_id) VALUES (?, ?)",
+                           [(steam_id, f) for f in friends])
+        friends_changed = cursor.rowcount > 0
+
+    # Cached profiles are built from libraries, friends' libraries and store data,
+    # so drop every one this write could have changed
+    stale_profiles = set()
+    if updated_games or new_games or friends_changed:
+        stale_profiles.add(steam_id)
+    if updated_games or new_games:
+        cursor.execute("SELECT user_id FROM Friends WHERE friend_id = ?", (steam_id,))
+        stale_profiles.update(row[0] for row in cursor.fetchall())
+    if games_with_store_data:
+        cursor.execute("""
+            SELECT DISTINCT user_id FROM UserGames
+            WHERE game_id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(games_with_store_data),))
+        stale_profiles.update(row[0] for row in cursor.fetchall())
+    drop_cached_profiles(cursor, stale_profiles)
+
+    return updated_games
+
+
+def drop_cached_profiles(cursor, user_ids):
+    """Forget cached profiles and recommendations so they are rebuilt from current data."""
+    if not user_ids:
+        return
+    user_ids = json.dumps([int(user_id) for user_id in user_ids])
+    cursor.execute("DELETE FROM UserProfiles WHERE user_id IN (SELECT value FROM json_each(?))", (user_ids,))
+    cursor.execute("DELETE FROM UserRecommendations WHERE user_id IN (SELECT value FROM json_each(?))",
+                   (user_ids,))
+
+
+def update_user_data(steam_id, api_key, force_update=False):
+    if not force_update and not should_update_user(steam_id):
+        print(f"[DEBUG] User {steam_id} was recently updated. Skipping...")
+        return
+
+    print(f"[DEBUG] Fetching data for Steam ID: {steam_id}")
+
+    games_data = fetch_owned_games(steam_id)
+    games_needing_store_data = set(get_games_needing_store_data())
+
+    store_infos = {}
+    for game in games_data:
+        if game['appid'] in games_needing_store_data:
+            store_infos[game['appid']] = fetch_store_info(game['appid'])
+    api_calls_made = len(store_infos)
+
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("PRAGMA foreign_keys = ON")
+    cursor = conn.cursor()
 
     cursor.execute("SELECT COUNT(*) FROM Friends WHERE user_id = ?", (steam_id,))
     existing_friends = cursor.fetchone()[0]
 
+    friends = None
     if existing_friends == 0:
         print("[DEBUG] Fetching friends list...")
         friends = fetch_friends(steam_id)
-        cursor.executemany("INSERT OR IGNORE INTO Users (user_id) VALUES (?)", [(f,) for f in friends])
-        cursor.executemany("INSERT OR IGNORE INTO Friends (user_id, friend_id) VALUES (?, ?)",
-                           [(steam_id, f) for f in friends])
     else:
         print(f"[DEBUG] Friends already cached ({existing_friends} friends)")
 
+    updated_games = store_user_data(cursor, steam_id, games_data, store_infos, friends, tracked=True)
+    print(f"[DEBUG] Made {api_calls_made} API calls, updated {updated_games} games with playtime changes")
+
     conn.commit()
     conn.close()
 
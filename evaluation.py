@@ -0,0 +1,99 @@
+import argparse
+import random
+import sqlite3
+import time
+import numpy as np
+from datetime import datetime
+from recommendation_engine import recommend, get_replay_time
+
+DB_FILE = "game_library.db"
+
+
+def get_evaluation_users(min_games=5):
+    """Return {user_id: [game_id, ...]} for users with enough tagged games to hold some out."""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT ug.user_id, ug.game_id
+        FROM UserGames ug
+        JOIN Games g ON ug.game_id = g.game_id
+        WHERE g.tags IS NOT NULL
+        ORDER BY ug.user_id, ug.game_id
+    """)
+    libraries = {}
+    for user_id, game_id in cursor.fetchall():
+        libraries.setdefault(user_id, []).append(game_id)
+    conn.close()
+
+    return {user_id: games for user_id, games in libraries.items() if len(games) >= min_games}
+
+
+def evaluate(k=10, holdout_fraction=0.2, seed=42, min_games=5, user_ids=None, as_of=None):
+    """Hide part of each user's library, replay recommend() offline and score what it finds.
+
+    as_of defaults to the newest playtime event, so the same DB and seed give the
+    same scores on any day. Returns mean precision@k and recall@k over the
+    evaluated users together with per-user latency and overall throughput.
+    """
+    as_of = as_of or get_replay_time()
+    libraries = get_evaluation_users(min_games)
+    if user_ids:
+        libraries = {user_id: libraries[user_id] for user_id in user_ids if user_id in libraries}
+
+    if not libraries:
+        print("[DEBUG] No users with enough games to evaluate")
+        return None
+
+    rng = random.Random(seed)
+    precisions = []
+    recalls = []
+    latencies = []
+
+    started = time.perf_counter()
+    for user_id, games in libraries.items():
+        hidden = set(rng.sample(games, max(1, int(len(games) * holdout_fraction))))
+
+        user_started = time.perf_counter()
+        top_df = recommend(user_id, top_n=k, offline=True, seed=seed, min_reviews=0, exclude_game_ids=hidden,
+                           as_of=as_of)
+        latencies.append(time.perf_counter() - user_started)
+
+        hits = len(set(top_df['game_id']) & hidden)
+        precisions.append(hits / k)
+        recalls.append(hits / len(hidden))
+    elapsed = time.perf_counter() - started
+
+    results = {
+        'users': len(libraries),
+        f'precision@{k}': float(np.mean(precisions)),
+        f'recall@{k}': float(np.mean(recalls)),
+        'mean_latency_ms': float(np.mean(latencies) * 1000),
+        'p95_latency_ms': float(np.percentile(latencies, 95) * 1000),
+        'users_per_second': len(libraries) / elapsed if elapsed > 0 else 0.0
+    }
+
+    print(f"\nOffline evaluation over {results['users']} users (k={k}, holdout={holdout_fraction}, seed={seed}, "
+          f"as_of={as_of.isoformat()}):")
+    print("-" * 50)
+    for name, value in results.items():
+        print(f"{name}: {value:.4f}" if isinstance(value, float) else f"{name}: {value}")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure offline ranking quality and speed of recommend().")
+    parser.add_argument("user_ids", nargs="*", type=int, help="only evaluate these users")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--holdout", type=float, default=0.2, help="fraction of each library to hide")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-games", type=int, default=5)
+    parser.add_argument("--as-of", type=datetime.fromisoformat, default=None,
+                        help="ISO time the recent-activity window ends at (default: newest playtime event)")
+    args = parser.parse_args()
+
+    evaluate(args.k, args.holdout, args.seed, args.min_games, args.user_ids, args.as_of)
+
+
+if __name__ == "__main__":
+    main()
@@ -71,7 +71,8 @@ def fetch_store_info(appid, country_code='us'):
     data = data_entry.get('data', {})
     price_info = data.get('price_overview')
     base_price = price_info['initial'] / 100 if price_info else None
-    developer = ", ".join(data.get('developers', []))
+    developers = data.get('developers', [])
+    developer = ", ".join(developers)
     release_date = data.get('release_date', {}).get('date')
     tags_list = [g.get('description', '') for g in data.get('genres', [])] if 'genres' in data else ['none']
     dlcs = data.get('dlc', [])
@@ -80,6 +81,7 @@ def fetch_store_info(appid, country_code='us'):
     return {
         'base_price': base_price,
         'developer': developer,
+        'developers': developers,
         'release_date': release_date,
         'tags': tags_list if tags_list else ['none'],
         'dlcs': dlcs,
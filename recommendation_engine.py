@@ -1,18 +1,24 @@
 import json
+import heapq
 import pandas as pd
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 from fetch_data import fetch_owned_games, fetch_all_steam_games, fetch_store_info, get_review_count
+from database import get_active_users
+from vocabulary import TAGS, DEVELOPERS, to_bits, popcount
 from pathlib import Path
 import sqlite3
 import numpy as np
 import random
-from collections import Counter
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta
 
 DB_FILE = "game_library.db"
 CACHE_FILE = Path("steam_cache.json")
 MIN_REVIEWS = 500
+RECENT_ACTIVITY_DAYS = 14
+RECENT_ACTIVITY_BOOST = 3.0
+RECOMMENDATION_CACHE_HOURS = 24
 
 if CACHE_FILE.exists():
     with open(CACHE_FILE, "r") as f:
@@ -20,97 +26,255 @@ if CACHE_FILE.exists():
 else:
     steam_cache = {}
 
-def get_user_profile(user_id):
+candidate_codes = {}
+
+def get_user_profile(user_id, exclude_game_ids=(), as_of=None):
+    """Build a user's profile at as_of (default now); games in exclude_game_ids count as not owned."""
+    as_of = as_of or datetime.now()
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
     
     cursor.execute("""
-        SELECT g.game_id, g.title, g.tags, g.developer, ug.hours_played, g.release_date
+        SELECT g.game_id, ug.hours_played
         FROM Games g
         JOIN UserGames ug ON g.game_id = ug.game_id
         WHERE ug.user_id = ? AND g.tags IS NOT NULL
         ORDER BY ug.hours_played DESC
     """, (user_id,))
-    owned_games = cursor.fetchall()
+    owned_games = [g for g in cursor.fetchall() if g[0] not in exclude_game_ids]
+    
+    cursor.execute("""
+        SELECT gt.game_id, gt.tag_id
+        FROM GameTagIds gt
+        JOIN UserGames ug ON gt.game_id = ug.game_id
+        WHERE ug.user_id = ?
+    """, (user_id,))
+    game_tags = defaultdict(list)
+    for game_id, tag_id in cursor.fetchall():
+        game_tags[game_id].append(tag_id)
+    
+    cursor.execute("""
+        SELECT gd.game_id, gd.developer_id
+        FROM GameDevelopers gd
+        JOIN UserGames ug ON gd.game_id = ug.game_id
+        WHERE ug.user_id = ?
+    """, (user_id,))
+    game_developers = defaultdict(list)
+    for game_id, developer_id in cursor.fetchall():
+        game_developers[game_id].append(developer_id)
     
     cursor.execute("""
         SELECT ug.game_id, COUNT(*) as friend_count
         FROM UserGames ug
         JOIN Friends f ON ug.user_id = f.friend_id
         WHERE f.user_id = ? AND ug.game_id NOT IN (
-            SELECT game_id FROM UserGames WHERE user_id = ?
+            SELECT game_id FROM UserGames
+            WHERE user_id = ? AND game_id NOT IN (SELECT value FROM json_each(?))
         )
         GROUP BY ug.game_id
-        ORDER BY friend_count DESC
+        ORDER BY friend_count DESC, ug.game_id
         LIMIT 100
-    """, (user_id, user_id))
+    """, (user_id, user_id, json.dumps(sorted(exclude_game_ids))))
     friends_games = dict(cursor.fetchall())
     
+    since = (as_of - timedelta(days=RECENT_ACTIVITY_DAYS)).isoformat()
+    cursor.execute("""
+        SELECT game_id, SUM(delta_hours), MIN(recorded_at)
+        FROM PlaytimeEvents
+        WHERE user_id = ? AND recorded_at >= ? AND recorded_at <= ?
+        GROUP BY game_id
+    """, (user_id, since, as_of.isoformat()))
+    recent_events = cursor.fetchall()
+    recent_hours = {game_id: delta for game_id, delta, _ in recent_events}
+    first_recent_event = {game_id: recorded_at for game_id, _, recorded_at in recent_events}
+    
     conn.close()
     
     if not owned_games:
         return None, friends_games
     
-    total_hours = sum(g[4] for g in owned_games)
+    # Games played recently count for more than their lifetime hours alone
+    boosted_hours = {g[0]: g[1] + RECENT_ACTIVITY_BOOST * max(recent_hours.get(g[0], 0), 0)
+                     for g in owned_games}
+    total_hours = sum(boosted_hours.values())
     
-    weighted_tags = []
-    weighted_developers = []
+    # The boost changes as soon as the oldest boosted event leaves the window
+    boosted_since = [first_recent_event[g[0]] for g in owned_games if recent_hours.get(g[0], 0) > 0]
+    valid_until = None
+    if boosted_since:
+        valid_until = datetime.fromisoformat(min(boosted_since)) + timedelta(days=RECENT_ACTIVITY_DAYS)
+        valid_until = valid_until.isoformat()
     
-    for game in owned_games:
-        tags = game[2] if game[2] else ""
-        developer = game[3] if game[3] else ""
-        hours = max(game[4], 0.1)
+    tag_counts = Counter()
+    developer_counts = Counter()
+    
+    for game_id, _ in owned_games:
+        hours = max(boosted_hours[game_id], 0.1)
         weight = hours / total_hours if total_hours > 0 else 1/len(owned_games)
         
-        if tags:
-            tag_list = [t.strip() for t in tags.split(',') if t.strip()]
-            weighted_tags.extend(tag_list * int(weight * 100 + 1))
+        for tag_id in game_tags.get(game_id, ()):
+            tag_counts[tag_id] += int(weight * 100 + 1)
         
-        if developer:
-            weighted_developers.extend([developer] * int(weight * 50 + 1))
+        for developer_id in game_developers.get(game_id, ()):
+            developer_counts[developer_id] += int(weight * 50 + 1)
     
-    top_tags = [tag for tag, count in Counter(weighted_tags).most_common(10)]
-    top_developers = [dev for dev, count in Counter(weighted_developers).most_common(5)]
+    top_tags = [tag_id for tag_id, count in tag_counts.most_common(10)]
+    top_developers = [dev_id for dev_id, count in developer_counts.most_common(5)]
     
-    high_playtime_games = [g for g in owned_games if g[4] > 10]
-    avg_playtime = np.mean([g[4] for g in owned_games]) if owned_games else 0
+    high_playtime_games = [g for g in owned_games if g[1] > 10]
+    avg_playtime = np.mean([g[1] for g in owned_games]) if owned_games else 0
     
+    # Tags and developers are interned ids so scoring never touches strings
     profile = {
         'preferred_tags': top_tags,
+        'preferred_tag_bits': to_bits(top_tags),
         'preferred_developers': top_developers,
         'avg_playtime': avg_playtime,
         'high_playtime_count': len(high_playtime_games),
-        'total_games': len(owned_games)
+        'total_games': len(owned_games),
+        'valid_until': valid_until
     }
     
     return profile, friends_games
 
-def get_smart_candidates(owned_game_ids, profile, friends_games):
-    all_steam_games = fetch_all_steam_games()
+def save_user_profile(user_id, profile, friends_games):
+    if profile:
+        profile = dict(profile, avg_playtime=float(profile['avg_playtime']))
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("""
+        INSERT INTO UserProfiles (user_id, profile, last_updated)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            profile=excluded.profile,
+            last_updated=excluded.last_updated
+    """, (user_id, json.dumps({'profile': profile, 'friends_games': friends_games}),
+          datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+def load_user_profile(user_id):
+    """Return the cached profile, building and caching it on first use."""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute("SELECT profile FROM UserProfiles WHERE user_id = ?", (user_id,))
+    result = cursor.fetchone()
+    conn.close()
+    
+    if result and result[0]:
+        cached = json.loads(result[0])
+        profile = cached['profile']
+        # Profiles from older cache formats, or whose recent-activity boost has
+        # started to age out, are rebuilt below
+        if profile is None or ('valid_until' in profile and (
+                profile['valid_until'] is None or profile['valid_until'] > datetime.now().isoformat())):
+            friends_games = {int(game_id): count for game_id, count in cached['friends_games'].items()}
+            return profile, friends_games
+    
+    profile, friends_games = get_user_profile(user_id)
+    save_user_profile(user_id, profile, friends_games)
+    return profile, friends_games
+
+def get_replay_time():
+    """Return the newest recorded playtime event, so replays of one DB see the same activity window."""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(recorded_at) FROM PlaytimeEvents")
+    result = cursor.fetchone()
+    conn.close()
+    return datetime.fromisoformat(result[0]) if result and result[0] else datetime.now()
+
+def get_offline_catalog():
+    """Build the candidate catalog from local Games rows and the store cache, with no API calls."""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute("SELECT game_id, title FROM Games ORDER BY game_id")
+    catalog = [{'appid': game_id, 'name': title or str(game_id)} for game_id, title in cursor.fetchall()]
+    conn.close()
+    
+    known_ids = {game['appid'] for game in catalog}
+    for key in sorted(steam_cache):
+        if key.isdigit() and int(key) not in known_ids and steam_cache[key]:
+            catalog.append({'appid': int(key), 'name': steam_cache[key].get('name', key)})
+    
+    return catalog
+
+def get_local_game_info():
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT game_id, tags, developer, base_price, average_rating, review_count
+        FROM Games
+        WHERE tags IS NOT NULL
+    """)
+    local_info = {
+        game_id: {
+            'tags': tags,
+            'developer': developer or '',
+            'base_price': base_price,
+            'average_rating': average_rating or 0,
+            'review_count': review_count or 0,
+            'tag_bits': 0,
+            'developer_ids': set()
+        }
+        for game_id, tags, developer, base_price, average_rating, review_count in cursor.fetchall()
+    }
+    
+    # Local games are already integer-coded, so their codes come straight from the join tables
+    cursor.execute("SELECT game_id, tag_id FROM GameTagIds")
+    for game_id, tag_id in cursor.fetchall():
+        if game_id in local_info:
+            local_info[game_id]['tag_bits'] |= 1 << tag_id
+    
+    cursor.execute("SELECT game_id, developer_id FROM GameDevelopers")
+    for game_id, developer_id in cursor.fetchall():
+        if game_id in local_info:
+            local_info[game_id]['developer_ids'].add(developer_id)
+    
+    conn.close()
+    return local_info
+
+def get_smart_candidates(owned_game_ids, profile, friends_games, rng=random, all_steam_games=None):
+    if all_steam_games is None:
+        all_steam_games = fetch_all_steam_games()
     if not all_steam_games:
         return []
     
     candidates = []
+    games_by_id = {g['appid']: g for g in all_steam_games}
     
     friend_candidates = []
     for game_id, friend_count in friends_games.items():
         if game_id not in owned_game_ids:
-            game_info = next((g for g in all_steam_games if g['appid'] == game_id), None)
+            game_info = games_by_id.get(game_id)
             if game_info:
                 friend_candidates.append((game_info, friend_count * 2))
     
+    friend_ids = {game['appid'] for game, _ in friend_candidates}
     recent_candidates = []
-    for game in random.sample(all_steam_games, min(5000, len(all_steam_games))):
-        if game['appid'] not in owned_game_ids:
+    for game in rng.sample(all_steam_games, min(5000, len(all_steam_games))):
+        if game['appid'] not in owned_game_ids and game['appid'] not in friend_ids:
             name = game['name'].lower()
             if not any(skip in name for skip in ['dlc', 'soundtrack', 'wallpaper', 'demo', 'beta']):
                 recent_candidates.append((game, 1))
     
     candidates = friend_candidates[:200] + recent_candidates[:1800]
-    random.shuffle(candidates)
+    rng.shuffle(candidates)
     
     return [c[0] for c in candidates[:500]]
 
+def get_candidate_codes(game_id, game_info):
+    """Encode a candidate's tags as a bitset and its developers as an id set, once per game.
+    
+    Codes are kept across runs and only dropped when the vocabularies change.
+    """
+    if 'tag_bits' in game_info:
+        return game_info['tag_bits'], game_info['developer_ids']
+    if game_id not in candidate_codes:
+        developers = game_info.get('developers') or game_info.get('developer', '')
+        candidate_codes[game_id] = (to_bits(TAGS.lookup(game_info.get('tags', []))),
+                                    set(DEVELOPERS.lookup(developers)))
+    return candidate_codes[game_id]
+
 def calculate_personalized_score(game_info, profile, friends_games, game_id):
     score = 0.0
     
@@ -119,25 +283,18 @@ def calculate_personalized_score(game_info, profile, friends_games, game_id):
     popularity_score = rating + np.log1p(review_count) * 0.1
     score += popularity_score * 0.3
     
-    tags = game_info.get('tags', [])
-    if isinstance(tags, list):
-        game_tags = [str(tag).strip().lower() for tag in tags]
-    else:
-        game_tags = [str(tag).strip().lower() for tag in str(tags).split(',')]
+    tag_bits, developer_ids = get_candidate_codes(game_id, game_info)
     
     tag_score = 0
     if profile and profile['preferred_tags']:
-        user_tags = [tag.lower() for tag in profile['preferred_tags']]
-        common_tags = len(set(game_tags) & set(user_tags))
-        tag_score = common_tags / max(len(user_tags), 1)
+        common_tags = popcount(tag_bits & profile['preferred_tag_bits'])
+        tag_score = common_tags / len(profile['preferred_tags'])
     
     score += tag_score * 0.4
     
-    developer = game_info.get('developer', '').lower()
     dev_score = 0
     if profile and profile['preferred_developers']:
-        user_devs = [dev.lower() for dev in profile['preferred_developers']]
-        if any(dev in developer for dev in user_devs):
+        if not developer_ids.isdisjoint(profile['preferred_developers']):
             dev_score = 0.5
     
     score += dev_score * 0.2
@@ -159,65 +316,99 @@ def calculate_personalized_score(game_info, profile, friends_games, game_id):
     
     return score
 
-def recommend(user_id, top_n=10):
+def iter_recommendations(user_id, top_n=10, offline=False, seed=None, min_reviews=MIN_REVIEWS,
+                         exclude_game_ids=None, as_of=None):
+    """Yield scored recommendations one at a time as candidates are confirmed.
+    
+    With offline=True every candidate and its store data come from the local DB and
+    steam_cache, and the whole candidate pool is scored. A fixed seed makes candidate
+    sampling repeatable, and as_of (default: the newest playtime event) pins the
+    recent-activity window. Games in exclude_game_ids are treated as not owned.
+    """
     print(f"[DEBUG] Starting personalized recommendations for user {user_id}")
     
-    profile, friends_games = get_user_profile(user_id)
+    tags_changed = TAGS.load()
+    developers_changed = DEVELOPERS.load()
+    if tags_changed or developers_changed:
+        candidate_codes.clear()
+    rng = random.Random(seed)
+    exclude_game_ids = set(exclude_game_ids or ())
+    
+    # Replays build the profile from the current DB and never touch the profile cache
+    if offline or exclude_game_ids:
+        if offline and as_of is None:
+            as_of = get_replay_time()
+        profile, friends_games = get_user_profile(user_id, exclude_game_ids, as_of)
+    else:
+        profile, friends_games = load_user_profile(user_id)
     print(f"[DEBUG] User profile: {len(profile['preferred_tags']) if profile else 0} preferred tags")
     print(f"[DEBUG] Friends data: {len(friends_games)} games from friends")
     
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
     cursor.execute("SELECT game_id FROM UserGames WHERE user_id = ?", (user_id,))
-    owned_game_ids = set([row[0] for row in cursor.fetchall()])
+    owned_game_ids = set([row[0] for row in cursor.fetchall()]) - exclude_game_ids
     conn.close()
     
     print(f"[DEBUG] User owns {len(owned_game_ids)} games")
     
     if not owned_game_ids:
-        return pd.DataFrame(columns=["game_id","title","tags","developer","price"])
+        return
     
-    candidates = get_smart_candidates(owned_game_ids, profile, friends_games)
+    if offline:
+        local_info = get_local_game_info()
+        candidates = get_smart_candidates(owned_game_ids, profile, friends_games, rng, get_offline_catalog())
+    else:
+        candidates = get_smart_candidates(owned_game_ids, profile, friends_games, rng)
     print(f"[DEBUG] Testing {len(candidates)} smart candidates")
     
-    recommendations = []
+    found = 0
     api_calls = 0
     
     for i, candidate in enumerate(candidates):
         if i % 100 == 0:
-            print(f"[DEBUG] Processed {i}/{len(candidates)} candidates, found {len(recommendations)} valid")
+            print(f"[DEBUG] Processed {i}/{len(candidates)} candidates, found {found} valid")
             
         appid = candidate['appid']
         title = candidate['name']
         
         review_count_key = f"{appid}_reviews"
-        if review_count_key in steam_cache:
-            review_count = steam_cache[review_count_key]
-        else:
-            review_count = get_review_count(appid)
-            steam_cache[review_count_key] = review_count
-            api_calls += 1
-        
-        if review_count < MIN_REVIEWS:
-            continue
-        
         appid_str = str(appid)
-        if appid_str in steam_cache:
-            info = steam_cache[appid_str]
-        else:
-            try:
-                info = fetch_store_info(appid)
-                if info:
-                    info['review_count'] = review_count
-                    steam_cache[appid_str] = info
-                    if api_calls % 20 == 0:
-                        with open(CACHE_FILE, "w") as f:
-                            json.dump(steam_cache, f)
-            except Exception as e:
-                print(f"[DEBUG] Error fetching info for {appid}: {e}")
-                info = None
         
-        api_calls += 1
+        if offline:
+            info = steam_cache.get(appid_str) or local_info.get(appid)
+            if not info:
+                continue
+            review_count = steam_cache.get(review_count_key, info.get('review_count', 0))
+            if review_count < min_reviews:
+                continue
+        else:
+            if review_count_key in steam_cache:
+                review_count = steam_cache[review_count_key]
+            else:
+                review_count = get_review_count(appid)
+                steam_cache[review_count_key] = review_count
+                api_calls += 1
+            
+            if review_count < min_reviews:
+                continue
+            
+            if appid_str in steam_cache:
+                info = steam_cache[appid_str]
+            else:
+                try:
+                    info = fetch_store_info(appid)
+                    if info:
+                        info['review_count'] = review_count
+                        steam_cache[appid_str] = info
+                        if api_calls % 20 == 0:
+                            with open(CACHE_FILE, "w") as f:
+                                json.dump(steam_cache, f)
+                except Exception as e:
+                    print(f"[DEBUG] Error fetching info for {appid}: {e}")
+                    info = None
+            
+            api_calls += 1
 
         if not info:
             continue
@@ -233,7 +424,7 @@ def recommend(user_id, top_n=10):
         else:
             tag_str = str(tags)
         
-        recommendations.append({
+        yield {
             'game_id': appid,
             'title': title,
             'tags': tag_str,
@@ -243,21 +434,80 @@ def recommend(user_id, top_n=10):
             'rating': info.get('average_rating', 0),
             'review_count': info.get('review_count', 0),
             'friends_own': friends_games.get(appid, 0)
-        })
+        }
+        found += 1
         
-        if len(recommendations) >= top_n * 3:
+        # The early stop only exists to save API calls; offline runs score the whole pool
+        if not offline and found >= top_n * 3:
             break
     
-    print(f"[DEBUG] Made {api_calls} API calls, found {len(recommendations)} valid games")
-    
-    if not recommendations:
+    print(f"[DEBUG] Made {api_calls} API calls, found {found} valid games")
+
+def recommend(user_id, top_n=10, offline=False, seed=None, min_reviews=MIN_REVIEWS, exclude_game_ids=None,
+              use_cache=False, as_of=None):
+    # Replays must reflect the current DB, so only live runs read or fill the cache
+    cacheable = use_cache and not offline and not exclude_game_ids
+    if cacheable:
+        cached_df = get_cached_recommendations(user_id)
+        if len(cached_df) >= top_n:
+            print(f"[DEBUG] Returning {top_n} cached recommendations")
+            return cached_df.head(top_n)
+    
+    # nlargest keeps a bounded heap of top_n rows instead of sorting every candidate
+    top_recs = heapq.nlargest(top_n, iter_recommendations(user_id, top_n, offline, seed, min_reviews,
+                                                          exclude_game_ids, as_of),
+                              key=lambda rec: rec['final_score'])
+    
+    if cacheable and top_recs:
+        save_recommendations(user_id, top_recs)
+    
+    if not top_recs:
         print("[DEBUG] No valid recommendations found")
         return pd.DataFrame(columns=["game_id","title","tags","developer","price"])
     
-    rec_df = pd.DataFrame(recommendations)
-    top_df = rec_df.sort_values("final_score", ascending=False).head(top_n)
+    top_df = pd.DataFrame(top_recs)
     
     print(f"[DEBUG] Top recommendation scores: {top_df['final_score'].tolist()}")
     print(f"[DEBUG] Returning {len(top_df)} personalized recommendations")
     
-    return top_df[["game_id","title","tags","developer","price"]]
\ No newline at end of file
+    return top_df[["game_id","title","tags","developer","price"]]
+
+def save_recommendations(user_id, recommendations):
+    now = datetime.now().isoformat()
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("DELETE FROM UserRecommendations WHERE user_id = ?", (user_id,))
+    conn.executemany("""
+        INSERT INTO UserRecommendations (user_id, rank, game_id, title, tags, developer, price, final_score, last_updated)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(user_id, rank, rec['game_id'], rec['title'], rec['tags'], rec['developer'], rec['price'],
+           rec['final_score'], now) for rank, rec in enumerate(recommendations)])
+    conn.commit()
+    conn.close()
+
+def get_cached_recommendations(user_id, max_age_hours=RECOMMENDATION_CACHE_HOURS):
+    """Return cached recommendations younger than max_age_hours; data changes clear them sooner."""
+    since = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+    conn = sqlite3.connect(DB_FILE)
+    cached_df = pd.read_sql("""
+        SELECT game_id, title, tags, developer, price
+        FROM UserRecommendations
+        WHERE user_id = ? AND last_updated >= ?
+        ORDER BY rank
+    """, conn, params=(user_id, since))
+    conn.close()
+    return cached_df
+
+def refresh_active_users(since_hours=24, min_delta_hours=1.0, top_n=10):
+    """Rebuild profiles and cached recommendations only for users whose playtime moved enough."""
+    active_users = get_active_users(since_hours, min_delta_hours)
+    print(f"[DEBUG] {len(active_users)} users passed the {min_delta_hours}h activity threshold")
+    
+    for user_id in active_users:
+        profile, friends_games = get_user_profile(user_id)
+        save_user_profile(user_id, profile, friends_games)
+        
+        top_recs = heapq.nlargest(top_n, iter_recommendations(user_id, top_n),
+                                  key=lambda rec: rec['final_score'])
+        save_recommendations(user_id, top_recs)
+    
+    return active_users
\ No newline at end of file
@@ -0,0 +1,325 @@
+import argparse
+import heapq
+import json
+import math
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+from fetch_data import fetch_owned_games, fetch_friends, fetch_store_info
+from vocabulary import TAGS, DEVELOPERS
+from database import (setup_database, store_user_data, get_games_needing_store_data,
+                      normalize_data, update_reviews_and_stats, rollup_playtime_events)
+
+DB_FILE = 'game_library.db'
+NEVER_UPDATED_HOURS = 24 * 365
+RECENT_ACTIVITY_DAYS = 14
+
+_STOP = object()
+
+
+class RateLimiter:
+    """Token bucket shared by every fetch worker so the whole pool stays under one API budget."""
+
+    def __init__(self, calls_per_second=1.0, burst=1):
+        self.rate = calls_per_second
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+def get_user_priorities(hours_threshold=24):
+    """Return (priority, user_id) for every tracked user older than hours_threshold, most urgent first.
+
+    Tracked users are the ones refreshed directly, whether or not they have any
+    friends. Rows created only because someone listed them as a friend are
+    refreshed through that friend, so successive passes do not crawl further
+    into the friend graph.
+
+    Priority grows with hours since the last refresh, with total playtime and
+    with recently recorded playtime changes, so stale, active accounts are
+    refreshed before idle ones.
+    """
+    now = datetime.now()
+    since = (now - timedelta(days=RECENT_ACTIVITY_DAYS)).isoformat()
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT u.user_id, u.last_updated, COALESCE(SUM(ug.hours_played), 0),
+               COALESCE((SELECT SUM(ABS(pe.delta_hours)) FROM PlaytimeEvents pe
+                         WHERE pe.user_id = u.user_id AND pe.recorded_at >= ?), 0)
+        FROM Users u
+        LEFT JOIN UserGames ug ON u.user_id = ug.user_id
+        WHERE u.user_id IN (SELECT user_id FROM TrackedUsers)
+        GROUP BY u.user_id
+    """, (since,))
+    rows = cursor.fetchall()
+    conn.close()
+
+    priorities = []
+    for user_id, last_updated, total_hours, recent_hours in rows:
+        try:
+            staleness = (now - datetime.fromisoformat(last_updated)).total_seconds() / 3600
+        except (TypeError, ValueError):
+            staleness = NEVER_UPDATED_HOURS
+
+        if staleness <= hours_threshold:
+            continue
+
+        activity = 1 + math.log1p(total_hours) / 10 + math.log1p(recent_hours) / 2
+        priorities.append((staleness * activity, user_id))
+
+    priorities.sort(reverse=True)
+    return priorities
+
+
+def get_stale_users(user_ids, hours_threshold=24):
+    """Return the subset of user_ids never refreshed or refreshed more than hours_threshold ago."""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT user_id, last_updated FROM Users
+        WHERE user_id IN (SELECT value FROM json_each(?))
+    """, (json.dumps([int(user_id) for user_id in user_ids]),))
+    last_updated = dict(cursor.fetchall())
+    conn.close()
+
+    cutoff = (datetime.now() - timedelta(hours=hours_threshold)).isoformat()
+    return [int(user_id) for user_id in user_ids
+            if not last_updated.get(int(user_id)) or last_updated[int(user_id)] < cutoff]
+
+
+class RefreshScheduler:
+    """Refresh many users concurrently and funnel every write through one SQLite writer thread."""
+
+    def __init__(self, max_workers=4, calls_per_second=1.0, batch_size=10,
+                 hours_threshold=24, include_friends=True, flush_interval=5.0,
+                 rerank=False, min_delta_hours=1.0, retention_days=30):
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(calls_per_second, burst=max_workers)
+        self.batch_size = batch_size
+        self.hours_threshold = hours_threshold
+        self.include_friends = include_friends
+        self.flush_interval = flush_interval
+        self.rerank = rerank
+        self.min_delta_hours = min_delta_hours
+        self.retention_days = retention_days
+
+        self.stop_event = threading.Event()
+        self._pending = []
+        self._seen = set()
+        self._seeds = set()
+        self._claimed_games = set()
+        self._claim_lock = threading.Lock()
+        self._write_queue = queue.Queue()
+
+    def enqueue(self, user_id, priority):
+        user_id = int(user_id)
+        if user_id in self._seen:
+            return
+        self._seen.add(user_id)
+        heapq.heappush(self._pending, (-priority, user_id))
+
+    def _claim_game(self, game_id):
+        with self._claim_lock:
+            if game_id in self._claimed_games:
+                return False
+            self._claimed_games.add(game_id)
+            return True
+
+    def _fetch_user(self, steam_id, games_needing_store_data):
+        self.limiter.acquire()
+        games_data = fetch_owned_games(steam_id)
+
+        # Friend lists are only kept for seed users; storing them for friends would
+        # turn every friend into a tracked user and widen the next pass
+        friends = None
+        if self.include_friends and steam_id in self._seeds:
+            self.limiter.acquire()
+            friends = fetch_friends(steam_id)
+
+        store_infos = {}
+        for game in games_data:
+            game_id = game['appid']
+            if game_id in games_needing_store_data and self._claim_game(game_id):
+                self.limiter.acquire()
+                store_infos[game_id] = fetch_store_info(game_id)
+
+        return steam_id, games_data, store_infos, friends, steam_id in self._seeds
+
+    def _flush(self, batch):
+        conn = sqlite3.connect(DB_FILE)
+        conn.execute("PRAGMA foreign_keys = ON")
+        cursor = conn.cursor()
+        try:
+            updated_games = 0
+            for steam_id, games_data, store_infos, friends, tracked in batch:
+                updated_games += store_user_data(cursor, steam_id, games_data, store_infos, friends,
+                                                 tracked=tracked)
+            conn.commit()
+            print(f"[DEBUG] Committed {len(batch)} users, {updated_games} games with playtime changes")
+        except Exception as e:
+            print(f"[ERROR] Error writing refresh batch: {e}")
+            conn.rollback()
+            # Ids interned during the failed batch were rolled back with it
+            TAGS.reset()
+            DEVELOPERS.reset()
+        finally:
+            conn.close()
+
+    def _writer_loop(self):
+        batch = []
+        while True:
+            try:
+                item = self._write_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                break
+            if item is not None:
+                batch.append(item)
+            if batch and (item is None or len(batch) >= self.batch_size):
+                self._flush(batch)
+                batch = []
+
+        if batch:
+            self._flush(batch)
+
+    def run_once(self, steam_ids=None):
+        """Refresh the given users (always) plus every stale user, then return."""
+        started_at = datetime.now()
+        self._pending = []
+        self._seen = set()
+        self._claimed_games = set()
+
+        for steam_id in steam_ids or []:
+            self.enqueue(steam_id, float('inf'))
+        for priority, user_id in get_user_priorities(self.hours_threshold):
+            self.enqueue(user_id, priority)
+
+        # Only friends of the users picked for this pass are pulled in, not the whole friend graph
+        self._seeds = set(self._seen)
+
+        if not self._pending:
+            print("[DEBUG] No users need refreshing.")
+            return 0
+
+        print(f"[DEBUG] Refreshing {len(self._pending)} users with {self.max_workers} workers")
+        games_needing_store_data = set(get_games_needing_store_data())
+
+        writer = threading.Thread(target=self._writer_loop, daemon=True)
+        writer.start()
+
+        refreshed = 0
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while (self._pending or in_flight) and not self.stop_event.is_set():
+                while self._pending and len(in_flight) < self.max_workers * 2:
+                    _, user_id = heapq.heappop(self._pending)
+                    in_flight.add(executor.submit(self._fetch_user, user_id, games_needing_store_data))
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        snapshot = future.result()
+                    except Exception as e:
+                        print(f"[ERROR] Error fetching user data: {e}")
+                        continue
+
+                    self._write_queue.put(snapshot)
+                    refreshed += 1
+
+                    if self.include_friends and snapshot[3]:
+                        for friend_id in get_stale_users(snapshot[3], self.hours_threshold):
+                            self.enqueue(friend_id, NEVER_UPDATED_HOURS)
+
+            for future in in_flight:
+                future.cancel()
+
+        self._write_queue.put(_STOP)
+        writer.join()
+
+        print("[DEBUG] Normalizing data...")
+        normalize_data()
+        print("[DEBUG] Updating reviews and game stats...")
+        update_reviews_and_stats()
+        print(f"[DEBUG] Refresh pass complete: {refreshed} users updated")
+
+        rollup_playtime_events(self.retention_days)
+        if self.rerank:
+            from recommendation_engine import refresh_active_users
+            since_hours = (datetime.now() - started_at).total_seconds() / 3600
+            refresh_active_users(since_hours, self.min_delta_hours)
+
+        return refreshed
+
+    def run_forever(self, steam_ids=None, poll_interval=3600):
+        """Keep refreshing stale users every poll_interval seconds until stop() is called."""
+        while not self.stop_event.is_set():
+            self.run_once(steam_ids)
+            steam_ids = None
+            self.stop_event.wait(poll_interval)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh Steam user data in the background.")
+    parser.add_argument("steam_ids", nargs="*", type=int, help="users to refresh regardless of staleness")
+    parser.add_argument("--daemon", action="store_true", help="keep running instead of a single catch-up pass")
+    parser.add_argument("--interval", type=float, default=3600, help="seconds between daemon passes")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=1.0, help="API calls per second across all workers")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--hours-threshold", type=float, default=24)
+    parser.add_argument("--no-friends", action="store_true", help="do not refresh friends of refreshed users")
+    parser.add_argument("--rerank", action="store_true",
+                        help="rebuild profiles and cached recommendations for users whose playtime changed")
+    parser.add_argument("--min-delta-hours", type=float, default=1.0)
+    parser.add_argument("--retention-days", type=int, default=30, help="days of raw playtime events to keep")
+    args = parser.parse_args()
+
+    from config_key import get_api_key
+    if not get_api_key():
+        print("[ERROR] API key not found. Exiting.")
+        exit(1)
+
+    setup_database()
+
+    scheduler = RefreshScheduler(max_workers=args.workers,
+                                 calls_per_second=args.rate,
+                                 batch_size=args.batch_size,
+                                 hours_threshold=args.hours_threshold,
+                                 include_friends=not args.no_friends,
+                                 rerank=args.rerank,
+                                 min_delta_hours=args.min_delta_hours,
+                                 retention_days=args.retention_days)
+    try:
+        if args.daemon:
+            scheduler.run_forever(args.steam_ids, poll_interval=args.interval)
+        else:
+            scheduler.run_once(args.steam_ids)
+    except KeyboardInterrupt:
+        scheduler.stop()
+        print("\n[DEBUG] Exiting scheduler.")
+
+
+if __name__ == "__main__":
+    main()
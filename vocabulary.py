@@ -0,0 +1,95 @@
+import re
+import sqlite3
+
+DB_FILE = 'game_library.db'
+
+
+LEGAL_SUFFIXES = ['inc', 'inc.', 'llc', 'llc.', 'l.l.c.', 'ltd', 'ltd.', 'limited', 'co', 'co.',
+                  'corp', 'corp.', 'gmbh', 's.a', 's.a.']
+LEGAL_SUFFIX_PATTERN = re.compile(r'(?:[,\s]+(?:' + '|'.join(re.escape(suffix) for suffix in LEGAL_SUFFIXES) + r'))+$')
+
+
+def split_names(value):
+    """Turn a list or comma-joined string of names into normalized, non-empty names."""
+    parts = value if isinstance(value, list) else str(value or '').split(',')
+    names = [str(part).strip().lower() for part in parts]
+    return [name for name in names if name]
+
+
+def split_developer_names(value):
+    """Normalize developer names; a list from the store API is never re-split.
+
+    Every trailing legal suffix is stripped so "CAPCOM Co., Ltd." from the API and
+    the "CAPCOM Co." left over from splitting the joined text column share one id,
+    and a bare "Ltd." produced by that split is dropped rather than becoming a developer.
+
+    >>> split_developer_names(['CAPCOM Co., Ltd.']) == split_developer_names('CAPCOM Co., Ltd.') == ['capcom']
+    True
+    >>> split_developer_names(['KOEI TECMO GAMES CO., LTD.', 'Valve'])
+    ['koei tecmo games', 'valve']
+    >>> split_developer_names('KOEI TECMO GAMES CO., LTD., Valve')
+    ['koei tecmo games', 'valve']
+    """
+    names = []
+    for name in split_names(value):
+        name = LEGAL_SUFFIX_PATTERN.sub('', name)
+        if name and name not in LEGAL_SUFFIXES:
+            names.append(name)
+    return names
+
+
+def to_bits(ids):
+    bits = 0
+    for item_id in ids:
+        bits |= 1 << item_id
+    return bits
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+class Vocabulary:
+    """In-memory interned mapping between the names in a lookup table and their integer ids."""
+
+    def __init__(self, table, id_column, split=split_names):
+        self.table = table
+        self.id_column = id_column
+        self.split = split
+        self.ids = {}
+
+    def load(self):
+        """Reload the mapping from the lookup table and return True if it changed."""
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {self.id_column}, name FROM {self.table}")
+        ids = {name: item_id for item_id, name in cursor.fetchall()}
+        conn.close()
+
+        changed = ids != self.ids
+        self.ids = ids
+        return changed
+
+    def reset(self):
+        self.ids = {}
+
+    def intern(self, cursor, names):
+        """Return ids for names, adding unseen names to the lookup table."""
+        ids = []
+        for name in self.split(names):
+            if name not in self.ids:
+                cursor.execute(f"INSERT OR IGNORE INTO {self.table} (name) VALUES (?)", (name,))
+                cursor.execute(f"SELECT {self.id_column} FROM {self.table} WHERE name = ?", (name,))
+                self.ids[name] = cursor.fetchone()[0]
+            ids.append(self.ids[name])
+        return ids
+
+    def lookup(self, names):
+        """Return ids for the names already known; unknown names cannot match anything stored."""
+        if not self.ids:
+            self.load()
+        return [self.ids[name] for name in self.split(names) if name in self.ids]
+
+
+TAGS = Vocabulary('Tags', 'tag_id')
+DEVELOPERS = Vocabulary('Developers', 'developer_id', split_developer_names)